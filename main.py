@@ -1,36 +1,527 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-from typing import Dict, Any, List
-import os, sqlite3, textwrap, re, hashlib, logging
+from typing import Dict, Any, List, Callable, Hashable
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import closing, asynccontextmanager, nullcontext
+from pathlib import Path
+import os, sqlite3, textwrap, re, hashlib, logging, asyncio, functools, threading, json, time, bisect, multiprocessing, gzip
+import itertools, queue, atexit
+import logging.handlers
+import contextvars
 
 from mcp.server.fastmcp import FastMCP
 from starlette.applications import Starlette
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse, Response
 from starlette.middleware.cors import CORSMiddleware
+try:
+    import brotli   # optional: `br` response encoding for the REST routes
+except ImportError:
+    brotli = None
 
 # ---------- Config ----------
 DB_PATH = os.getenv("DB_PATH", "build/index.db")
 MAX_PREVIEW = int(os.getenv("MAX_PREVIEW_CHARS", "220"))
+SNIPPET_TOKENS = min(64, max(1, int(os.getenv("SNIPPET_TOKENS", "32"))))   # FTS5 caps snippet() at 64
+SNIPPET_MARK = os.getenv("SNIPPET_MARK", "**")                              # wraps matched terms in previews
+# bm25() weights for the pages_fts columns (title, headings, text); missing weights default to 1
+BM25_WEIGHTS = (*(float(w) for w in os.getenv("BM25_WEIGHTS", "10,4,1").split(",")), 1.0, 1.0)[:3]
+PREVIEW_MODE = os.getenv("PREVIEW_MODE", "snippet")   # snippet: keyword-aligned | lead: stored lead, never reads text
+SEARCH_CACHE_ENTRIES = int(os.getenv("SEARCH_CACHE_ENTRIES", "2048"))
+SEARCH_CACHE_BYTES = int(os.getenv("SEARCH_CACHE_BYTES", str(32 << 20)))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "3600"))   # seconds; 0 = no expiry
+PAGE_CACHE_BYTES = int(os.getenv("PAGE_CACHE_BYTES", str(64 << 20)))
+PACK_STORE_BYTES = int(os.getenv("PACK_STORE_BYTES", str(64 << 20)))   # results retrievable by pack_id via get_pack
+PACK_TTL = float(os.getenv("PACK_TTL", "3600"))   # seconds; 0 = no expiry
+MAX_BATCH = int(os.getenv("MAX_BATCH", "32"))   # max queries/urls per search_many/pages call
+MAX_SUGGEST = int(os.getenv("MAX_SUGGEST", "10"))
+DB_POOL_SIZE = max(1, int(os.getenv("DB_POOL_SIZE", "8")))   # worker threads == read-only connections
+DB_IMMUTABLE = os.getenv("DB_IMMUTABLE", "0") == "1"    # index never changes while served: skip locking
+# >1: run retrieval in N worker processes (one GIL each) that share index.db through the OS page
+# cache/mmap; SSE sessions and the caches stay in this process, so no sticky routing is needed
+DB_WORKERS = int(os.getenv("DB_WORKERS", "0"))
+# copy the whole index into RAM at startup (single-process only: workers would each hold a copy)
+DB_IN_MEMORY = os.getenv("DB_IN_MEMORY", "0") == "1" and DB_WORKERS <= 1
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 << 20)))
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-16384"))   # PRAGMA cache_size per connection (negative = KiB)
+INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", "5"))   # seconds between index file checks; 0 = off
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")   # enables POST /admin/reload (Bearer token)
+# stateless streamable-HTTP MCP endpoint (JSON responses, no session state) next to SSE; "" = off
+MCP_HTTP_PATH = os.getenv("MCP_HTTP_PATH", "/mcp")
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))   # smaller REST responses are sent uncompressed
+WARMUP = os.getenv("WARMUP", "1") == "1"   # prefetch the DB file and replay hot queries before /readyz passes
+WARMUP_QUERIES = os.getenv("WARMUP_QUERIES", "")   # file with one search query per line
+ACCESS_LOG = os.getenv("ACCESS_LOG", "")   # JSON lines of served search/page calls; replayed by the next warmup
+WARMUP_TOP = int(os.getenv("WARMUP_TOP", "500"))   # max distinct calls replayed
+READY_PROBE_TTL = float(os.getenv("READY_PROBE_TTL", "5"))   # seconds a /readyz DB probe result is reused
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))   # log DB calls slower than this, with their plan; 0 = off
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "")   # JSON-lines file for slow queries (default: the server log)
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("cloudscape-mcp")
+slow_log = logging.getLogger("cloudscape-mcp.slow")
+# handlers check: `python main.py` imports this module twice (__main__, then uvicorn's "main:app")
+if SLOW_QUERY_LOG and not slow_log.handlers:
+    slow_log.addHandler(logging.FileHandler(SLOW_QUERY_LOG))   # one JSON object per line (O_APPEND: safe across workers)
+    slow_log.propagate = False
+access_log = logging.getLogger("cloudscape-mcp.access")
+_replaying = contextvars.ContextVar("replaying", default=False)   # warmup calls stay out of the access log
+access_log.propagate = False
+if ACCESS_LOG and not access_log.handlers:
+    # the tools only enqueue; a listener thread does the file writes and flushes off the event loop
+    _access_queue: queue.SimpleQueue = queue.SimpleQueue()
+    access_log.addHandler(logging.handlers.QueueHandler(_access_queue))
+    _access_listener = logging.handlers.QueueListener(_access_queue, logging.FileHandler(ACCESS_LOG))
+    _access_listener.start()
+    atexit.register(_access_listener.stop)   # drains what is still queued
 
 # ---------- MCP ----------
 mcp = FastMCP(
     "cloudscape",
-    instructions="Tools for AWS Cloudscape UI RAG: search buckets and fetch page content."
+    instructions="Tools for AWS Cloudscape UI RAG: search buckets and fetch page content.",
+    # every POST to MCP_HTTP_PATH is self-contained: any process behind a load balancer can answer it
+    stateless_http=True,
+    json_response=True,
+    streamable_http_path=MCP_HTTP_PATH or "/mcp",
 )
 
+# ---------- Metrics ----------
+# Prometheus text exposition, hand-rolled: series are only updated on the event loop, so no locks.
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1 << 20, 4 << 20)
+_Labels = tuple[tuple[str, str], ...]
+
+def _fmt_labels(labels: _Labels) -> str:
+    if not labels:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+class _Counter:
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self._series: Dict[_Labels, float] = {}
+
+    def inc(self, labels: _Labels = (), v: float = 1) -> None:
+        self._series[labels] = self._series.get(labels, 0) + v
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter",
+                *(f"{self.name}{_fmt_labels(k)} {v}" for k, v in sorted(self._series.items()))]
+
+class _Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...]):
+        self.name, self.help, self.buckets = name, help, buckets
+        self._series: Dict[_Labels, List[float]] = {}   # per-bucket counts, then sum, count
+
+    def observe(self, labels: _Labels, v: float) -> None:
+        s = self._series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+        i = bisect.bisect_left(self.buckets, v)   # first bucket with le >= v; cumulated at render
+        if i < len(self.buckets):
+            s[i] += 1
+        s[-2] += v
+        s[-1] += 1
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, s in sorted(self._series.items()):
+            cum = 0
+            for le, n in zip(self.buckets, s):
+                cum += n
+                out.append(f"{self.name}_bucket{_fmt_labels((*labels, ('le', str(le))))} {cum}")
+            out.append(f"{self.name}_bucket{_fmt_labels((*labels, ('le', '+Inf')))} {s[-1]}")
+            out.append(f"{self.name}_sum{_fmt_labels(labels)} {s[-2]}")
+            out.append(f"{self.name}_count{_fmt_labels(labels)} {s[-1]}")
+        return out
+
+_tool_calls = _Counter("cloudscape_tool_requests_total", "MCP tool calls by tool and status (ok|error|exception).")
+_tool_latency = _Histogram("cloudscape_tool_latency_seconds", "MCP tool latency, cache hits included.", LATENCY_BUCKETS)
+_tool_bytes = _Histogram("cloudscape_tool_response_bytes",
+                         "Bytes sent per MCP tool result (JSON-RPC response body, or its SSE event).", BYTES_BUCKETS)
+_stage_latency = _Histogram("cloudscape_db_stage_seconds",
+                            "Time per retrieval stage inside a DB call (fts = MATCH + ranking + snippet() in SQLite; "
+                            "bucket_preview = Python bucketing and preview shortening).", LATENCY_BUCKETS)
+_stage_rows = _Counter("cloudscape_db_rows_total", "Rows fetched from SQLite per retrieval stage.")
+_sse_sessions = 0
+_sse_sessions_total = _Counter("cloudscape_sse_sessions_total", "MCP SSE sessions opened.")
+
+def _record(stage: str, t0: float, rows: int = 0) -> None:
+    """Note a retrieval stage on the calling pool thread/worker; shipped back with the call's result."""
+    stages = getattr(_local, "stages", None)
+    if stages is not None:
+        stages.append((stage, time.perf_counter() - t0, rows))
+
+def _slow(kind: str, t0: float, stmts: List[tuple[str, Any]], **fields: Any) -> None:
+    """Log a DB call that took longer than SLOW_QUERY_MS as JSON, with EXPLAIN QUERY PLAN of its statements.
+
+    Runs on the pool thread/worker that executed the call, while its connection is still at hand.
+    """
+    ms = (time.perf_counter() - t0) * 1000
+    if not SLOW_QUERY_MS or ms < SLOW_QUERY_MS:
+        return
+    plans = []
+    for sql, args in stmts:
+        depth: Dict[int, int] = {}
+        lines = []
+        for r in db().execute("EXPLAIN QUERY PLAN " + sql, args):
+            depth[r[0]] = depth.get(r[1], -1) + 1
+            lines.append("  " * depth[r[0]] + r[3])
+        plans.append(lines)
+    target = getattr(_local, "target", None) or _current.target
+    slow_log.warning(json.dumps({"ts": round(time.time(), 3), "kind": kind, "ms": round(ms, 2), **fields,
+                                 "generation": target[1], "pid": os.getpid(), "plan": plans}, ensure_ascii=False))
+
+_tool_names: set[str] = set()
+
+def _instrumented(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Count and time every call of an MCP tool (keeps the signature FastMCP introspects); response
+    bytes are measured where they are sent, in _meter_tools."""
+    tool = (("tool", fn.__name__),)
+    _tool_names.add(fn.__name__)
+
+    @functools.wraps(fn)
+    async def timed(*args: Any, **kwargs: Any) -> Any:
+        t0, status = time.perf_counter(), "exception"
+        try:
+            res = await fn(*args, **kwargs)
+            status = "error" if isinstance(res, dict) and "error" in res else "ok"
+            return res
+        finally:
+            _tool_latency.observe(tool, time.perf_counter() - t0)
+            _tool_calls.inc((*tool, ("status", status)))
+    return timed
+
+def _track_sessions(inner: Any) -> Any:
+    """ASGI wrapper counting open `GET /sse` streams."""
+    async def asgi(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        global _sse_sessions
+        if scope["type"] != "http" or not scope["path"].endswith("/sse"):
+            return await inner(scope, receive, send)
+        _sse_sessions += 1
+        _sse_sessions_total.inc()
+        try:
+            await inner(scope, receive, send)
+        finally:
+            _sse_sessions -= 1
+    return asgi
+
+# A tool reply leaves over SSE as one event on the session's GET /sse stream, while the call came in on
+# POST /messages/?session_id=...: remember which tool each (session, JSON-RPC id) called until its event is sent.
+_sse_calls: Dict[tuple[str, bytes], str] = {}
+_SESSION_RE = re.compile(rb"session_id=([0-9a-fA-F]+)")
+_RPC_ID_RE = re.compile(rb'"id":\s*("(?:[^"\\]|\\.)*"|-?\d+)')
+
+def _tool_call(body: bytes) -> tuple[bytes, str] | None:
+    """(JSON-encoded id, tool name) of a JSON-RPC tools/call request."""
+    try:
+        msg = json.loads(body)
+    except ValueError:
+        return None
+    if (isinstance(msg, dict) and msg.get("method") == "tools/call" and isinstance(msg.get("params"), dict)
+            and msg["params"].get("name") in _tool_names):
+        return json.dumps(msg.get("id")).encode(), msg["params"]["name"]
+    return None
+
+def _meter_tools(inner: Any) -> Any:
+    """ASGI wrapper observing cloudscape_tool_response_bytes from the body bytes actually sent: the JSON-RPC
+    response of a streamable-HTTP call, or the SSE event carrying the reply of a call made over SSE."""
+    async def asgi(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            return await inner(scope, receive, send)
+        if scope["path"].endswith("/sse"):
+            session = None
+
+            async def sse_send(msg: Dict[str, Any]) -> None:
+                nonlocal session
+                body = msg.get("body", b"")
+                if msg["type"] == "http.response.body" and body:
+                    if session is None:   # the first event names the session's POST endpoint
+                        m = _SESSION_RE.search(body)
+                        session = m.group(1).decode().lower() if m else None
+                    elif (m := _RPC_ID_RE.search(body, 0, 200)) and (tool := _sse_calls.pop((session, m.group(1)), None)):
+                        _tool_bytes.observe((("tool", tool),), len(body))
+                await send(msg)
+            try:
+                return await inner(scope, receive, sse_send)
+            finally:
+                for k in [k for k in _sse_calls if k[0] == session]:
+                    del _sse_calls[k]
+        if scope["method"] != "POST":
+            return await inner(scope, receive, send)
+        m = _SESSION_RE.search(scope.get("query_string", b""))
+        session, chunks, call, sent = m.group(1).decode().lower() if m else None, [], None, 0
+
+        async def recv() -> Dict[str, Any]:
+            nonlocal call
+            msg = await receive()
+            if msg["type"] == "http.request":
+                chunks.append(msg.get("body", b""))
+                if not msg.get("more_body") and (call := _tool_call(b"".join(chunks))) and session:
+                    _sse_calls[(session, call[0])] = call[1]   # before the SDK hands it to the session
+            return msg
+
+        async def http_send(msg: Dict[str, Any]) -> None:
+            nonlocal sent
+            if msg["type"] == "http.response.start" and call and session and msg["status"] >= 400:
+                _sse_calls.pop((session, call[0]), None)   # unknown session: no event will ever come
+            elif msg["type"] == "http.response.body" and call and not session:
+                sent += len(msg.get("body", b""))
+                if not msg.get("more_body"):
+                    _tool_bytes.observe((("tool", call[1]),), sent)
+            await send(msg)
+        await inner(scope, recv, http_send)
+    return asgi
+
 # ---------- DB helpers ----------
-_db: sqlite3.Connection | None = None
+# Each pool thread (or worker process) lazily opens its own read-only connection to the
+# index generation a call was dispatched for, so queries never share a connection, never
+# run on the event loop, and a hot-swapped index is picked up on the next call.
+_local = threading.local()
+_pool = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+_conns: Dict[tuple[str, str, str, int], List[sqlite3.Connection]] = {}   # index target -> pool connections
+_conns_lock = threading.Lock()
+_index_ids = itertools.count(1)
+
+def _disk_uri(path: str) -> str:
+    return Path(path).resolve().as_uri() + "?mode=ro" + ("&immutable=1" if DB_IMMUTABLE else "")
+
+def _file_ident(path: str) -> str:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return ""
+    return f"{st.st_ino}:{st.st_mtime_ns}:{st.st_size}"
+
+def _read_generation(path: str) -> str:
+    """`meta.generation` written by the indexer (file identity for older indexes; "" if missing)."""
+    gen = _file_ident(path)
+    if gen:
+        try:
+            with closing(sqlite3.connect(_disk_uri(path), uri=True)) as c:
+                row = c.execute("SELECT value FROM meta WHERE key='generation'").fetchone()
+                gen = row[0] if row else gen
+        except sqlite3.Error:
+            pass   # index built before `meta` existed: fall back to file identity
+    return gen
+
+class _Index:
+    """One opened index generation; retired instances close their connections once drained."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ident = _file_ident(path)
+        self.generation = _read_generation(path)
+        self.uri = _disk_uri(path)
+        self.keeper: sqlite3.Connection | None = None   # keeps an in-memory copy alive
+        self.active = 0   # in-flight calls; only touched on the event loop
+        self.retired = False
+        # distinguishes instances opened on the same file and generation (e.g. a candidate
+        # retried after a failed swap), whose closed connections must never be reused
+        self.id = next(_index_ids)
+
+    @property
+    def target(self) -> tuple[str, str, str, int]:
+        # plain tuple: crosses into worker processes
+        return self.path, self.generation, self.uri, self.id
+
+    def load_memdb(self) -> None:
+        """Copy the index into a process-wide in-memory database (memdb names starting with "/"
+        are shared by every connection in the process)."""
+        uri = "file:/cloudscape-" + re.sub(r"\W", "", self.generation) + "?vfs=memdb"
+        self.keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        with closing(sqlite3.connect(_disk_uri(self.path), uri=True)) as disk:
+            if hasattr(disk, "serialize"):
+                data = bytearray(disk.serialize())
+                data[18] = data[19] = 1   # WAL -> rollback journal: memdb cannot open WAL images
+                with closing(sqlite3.connect(":memory:")) as tmp:
+                    tmp.deserialize(bytes(data))
+                    tmp.backup(self.keeper)
+            else:   # Python < 3.11: plain copy, fine for the indexer's (rollback journal) output
+                disk.backup(self.keeper)
+                try:
+                    self.keeper.execute("SELECT 1 FROM sqlite_master").fetchall()
+                except sqlite3.Error:
+                    raise RuntimeError(f"{self.path} is in WAL mode: DB_IN_MEMORY needs Python 3.11+ for it "
+                                       "(or run PRAGMA journal_mode=DELETE on the index)") from None
+        self.uri = uri + "&mode=ro"
+        size = self.keeper.execute("PRAGMA page_count").fetchone()[0] * self.keeper.execute("PRAGMA page_size").fetchone()[0]
+        log.info("Loaded %s into memory (%.1f MiB)", self.path, size / (1 << 20))
+
+    def retire(self) -> None:
+        self.retired = True
+        if self.active == 0:
+            self.close()
+
+    def release(self) -> None:
+        """End a call (or a pin) counted in `active`; the last one out closes a retired index."""
+        self.active -= 1
+        if self.retired and self.active == 0:
+            self.close()
+
+    def close(self) -> None:
+        with _conns_lock:
+            conns = _conns.pop(self.target, [])
+        for c in conns:
+            c.close()
+        if self.keeper is not None:
+            self.keeper.close()
+            self.keeper = None
+
+_current = _Index(DB_PATH)
+
 def db() -> sqlite3.Connection:
-    global _db
-    if _db is None:
-        if not os.path.exists(DB_PATH):
-            raise RuntimeError(f"DB not found: {DB_PATH}. Run `make index` or mount the DB.")
-        _db = sqlite3.connect(DB_PATH, check_same_thread=False)
-        _db.row_factory = sqlite3.Row
-    return _db
+    target = getattr(_local, "target", None) or _current.target
+    path, _, uri, _ = target
+    conn = getattr(_local, "db", None)
+    if conn is None or _local.db_target != target:
+        if conn is not None:
+            conn.close()   # previous generation; this thread is its only user
+            _local.db = None   # never hand it out again, even if opening the next one fails
+        if not os.path.exists(path):
+            raise RuntimeError(f"DB not found: {path}. Run `make index` or mount the DB.")
+        # check_same_thread=False only so a drained generation can be closed from the loop thread
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+            conn.execute(f"PRAGMA cache_size={DB_CACHE_SIZE}")
+        except sqlite3.Error:   # e.g. a rejected candidate that is not a database: don't leak its file
+            conn.close()
+            raise
+        with _conns_lock:
+            _conns.setdefault(target, []).append(conn)
+        _local.db, _local.db_target = conn, target
+    return conn
+
+_procs: ProcessPoolExecutor | None = None
+_worker_stats: Dict[str, Dict[str, float]] = {}
+
+def _in_worker(target: tuple[str, str, str, int], fn: Callable[..., Any], *args: Any) -> tuple[str, float, list, Any]:
+    _local.target, _local.stages = target, []
+    t0 = time.perf_counter()
+    res = fn(*args)
+    return f"{os.getpid()}/{threading.current_thread().name}", time.perf_counter() - t0, _local.stages, res
+
+def _open() -> None:
+    db()
+
+# Shared by the parent and every worker process (handed over by the pool initializer: multiprocessing
+# primitives cannot be pickled into tasks); lets _drop_retired reach each worker exactly once.
+_worker_barrier: Any = None
+
+def _init_worker(barrier: Any) -> None:
+    global _worker_barrier
+    _worker_barrier = barrier
+
+def _drop_retired() -> None:
+    """Worker-process side of a swap: switch to the dispatched index, close connections to any other, then
+    wait for the other workers, so that each of the DB_WORKERS broadcast tasks lands on a different worker."""
+    db()
+    with _conns_lock:
+        stale = [c for t in [t for t in _conns if t != _local.target] for c in _conns.pop(t)]
+    for c in stale:
+        c.close()
+    try:
+        _worker_barrier.wait(30)   # a worker busy for longer just runs its task late
+    except threading.BrokenBarrierError:
+        pass
+
+async def _run_on(idx: _Index, fn: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking DB call against `idx` on the connection pool (or the worker processes
+    with DB_WORKERS>1)."""
+    global _procs, _worker_barrier
+    if DB_WORKERS > 1:
+        if _procs is None:
+            # spawn, not fork: this process already runs an event loop and threads
+            ctx = multiprocessing.get_context("spawn")
+            _worker_barrier = ctx.Barrier(DB_WORKERS)
+            _procs = ProcessPoolExecutor(DB_WORKERS, mp_context=ctx, initializer=_init_worker,
+                                         initargs=(_worker_barrier,))
+        executor: Any = _procs
+    else:
+        executor = _pool
+    idx.active += 1
+    try:
+        worker, secs, stages, res = await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(_in_worker, idx.target, fn, *args))
+    finally:
+        idx.release()
+    st = _worker_stats.setdefault(worker, {"calls": 0, "busy_s": 0.0})
+    st["calls"] += 1
+    st["busy_s"] += secs
+    for stage, t, rows in stages:
+        _stage_latency.observe((("stage", stage),), t)
+        if rows:
+            _stage_rows.inc((("stage", stage),), rows)
+    return res
+
+async def _run(fn: Callable[..., Any], *args: Any) -> Any:
+    return await _run_on(_current, fn, *args)
+
+def _generation() -> str:
+    """Generation of the index currently being served; part of every cache key."""
+    return _current.generation
+
+# ---------- Caches ----------
+class _LRU:
+    """Thread-safe LRU bounded by entry count and total (JSON) bytes, with optional TTL."""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float = 0.0):
+        self.max_entries, self.max_bytes, self.ttl = max_entries, max_bytes, ttl
+        self._d: OrderedDict[Hashable, tuple[float, int, Any]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key: Hashable, count: bool = True) -> Any:
+        with self._lock:
+            e = self._d.get(key)
+            if e is not None and self.ttl and time.monotonic() - e[0] > self.ttl:
+                self._bytes -= self._d.pop(key)[1]
+                e = None
+            if e is None:
+                self.misses += count
+                return None
+            self._d.move_to_end(key)
+            self.hits += count
+            return e[2]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = len(json.dumps(value, ensure_ascii=False, default=str))
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._d:
+                self._bytes -= self._d.pop(key)[1]
+            self._d[key] = (time.monotonic(), size, value)
+            self._bytes += size
+            while len(self._d) > self.max_entries or self._bytes > self.max_bytes:
+                self._bytes -= self._d.popitem(last=False)[1][1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._d.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"entries": len(self._d), "bytes": self._bytes, "hits": self.hits, "misses": self.misses,
+                    "hit_ratio": round(self.hits / total, 4) if total else 0.0}
+
+# keyed by (generation, normalized query, k_*), so a rebuilt index never serves stale hits
+_search_cache = _LRU(SEARCH_CACHE_ENTRIES, SEARCH_CACHE_BYTES, SEARCH_CACHE_TTL)
+# keyed by (generation, url); bounded by total bytes only (misses are cached too)
+_page_cache = _LRU(1 << 30, PAGE_CACHE_BYTES)
+# pack_id -> (generation, result); survives index swaps: a pack id already names its generation
+_packs = _LRU(1 << 30, PACK_STORE_BYTES, PACK_TTL)
+
+def _keep(gen: str, res: Dict[str, Any]) -> Dict[str, Any]:
+    """Make a result retrievable by its `pack_id` (get_pack); an already stored pack is just refreshed."""
+    pid = res.get("pack_id")
+    if pid and _packs.get(pid, count=False) is None:
+        _packs.put(pid, (gen, res))
+    return res
 
 def _short(s: str) -> str:
     s = re.sub(r"\s+", " ", (s or "")).strip()
@@ -39,73 +530,743 @@ def _short(s: str) -> str:
 def _sha10(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()[:10]
 
-def _bucket(url: str) -> str:
-    u = url.lower()
-    if "cloudscape.design/components/" in u and "tabid=api" in u:   return "components.api"
-    if "cloudscape.design/components/" in u and "tabid=usage" in u: return "components.usage"
-    if "cloudscape.design/patterns/" in u:                          return "patterns"
-    if u.startswith("typedoc://"):                                  return "typedoc"
-    return "other"
-
-def _fts(q: str, limit: int) -> List[sqlite3.Row]:
-    sql = """
-    SELECT p.id, p.url, p.title, p.text, bm25(pages_fts) AS rank
-    FROM pages_fts
-    JOIN pages p ON p.rowid = pages_fts.rowid
-    WHERE pages_fts MATCH ?
-    ORDER BY rank ASC
-    LIMIT ?
+def _pack_id(kind: str, *parts: Any) -> str:
+    """Handle for a result: hash of the index generation it is read from plus the canonical request."""
+    gen = (getattr(_local, "target", None) or _current.target)[1]
+    return hashlib.sha256("\x1f".join(map(str, (gen, kind, *parts))).encode("utf-8")).hexdigest()[:16]
+
+# ---------- FTS5 query compilation ----------
+# Explicit FTS5 syntax: phrases, boolean/NEAR operators, prefix stars, grouping, column filters.
+_FTS_SYNTAX_RE = re.compile(r'"|\b(?:AND|OR|NOT|NEAR)\b|\w\*|[()]|\b(?:title|headings|text)\s*:|\{')
+_FTS_OPERATORS = {"AND", "OR", "NOT", "NEAR"}
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def _free_text(q: str) -> str:
+    """Quote every word so punctuation can never reach the FTS5 parser.
+
+    Hyphenated/dotted words become phrases ("side-navigation" -> "side navigation"),
+    a trailing `*` is kept as a prefix query, bare operators are dropped and terms are
+    implicitly ANDed.
     """
-    return list(db().execute(sql, (q, limit)))
+    terms = []
+    for word in re.split(r"[\s()]+", q):
+        parts = _WORD_RE.findall(word) if word not in _FTS_OPERATORS else []
+        if parts:
+            terms.append('"' + " ".join(parts) + '"' + ("*" if word.endswith("*") and len(parts) == 1 else ""))
+    return " ".join(terms)
+
+@functools.lru_cache(maxsize=4096)
+def _compile_query(q: str) -> tuple[str, ...]:
+    """MATCH expressions to try in order: the raw query when it uses FTS5 syntax
+    with balanced quotes/parens, then the always-valid quoted free-text form.
+
+    Empty when nothing in q is searchable (only punctuation or bare operators): the raw
+    form would then be the sole candidate, with nothing valid to fall back to.
+    """
+    free = _free_text(q)
+    if not free:
+        return ()
+    raw_ok = _FTS_SYNTAX_RE.search(q) and q.count('"') % 2 == 0 and q.count("(") == q.count(")")
+    return tuple(dict.fromkeys(x for x in ((q if raw_ok else ""), free) if x))
+
+# `pages.bucket` values written by the indexer
+BUCKETS = ("components.api", "components.usage", "patterns", "typedoc")
+
+def _fts(q: str, per_bucket: Dict[str, int]) -> List[sqlite3.Row]:
+    """Top-k rows per bucket in one windowed query, with per-bucket min-max normalized
+    scores; buckets with k<=0 are not queried.
+
+    Hits are bucketed and described by the precomputed metadata columns, which the
+    indexer stores ahead of `text`, so page text is only touched by snippet() (and
+    not at all with PREVIEW_MODE=lead).
+    """
+    want = {b: k for b, k in per_bucket.items() if k > 0}
+    if not want:
+        return []
+    buckets = list(want)
+    snippet = PREVIEW_MODE == "snippet"
+    sql = f"""
+    WITH ranked AS (
+        SELECT pages_fts.rowid AS id, b.bucket, bm25(pages_fts, ?, ?, ?) AS rank
+        FROM pages_fts
+        JOIN (SELECT id, bucket FROM pages WHERE bucket IN ({",".join("?" * len(buckets))})) b
+          ON b.id = pages_fts.rowid
+        WHERE pages_fts MATCH ?
+    ), top AS (
+        SELECT id, bucket, rank, ROW_NUMBER() OVER w AS rn,
+               MIN(rank) OVER b AS lo, MAX(rank) OVER b AS hi
+        FROM ranked
+        WINDOW w AS (PARTITION BY bucket ORDER BY rank), b AS (PARTITION BY bucket)
+    )
+    SELECT p.id, p.url, p.title, top.bucket, top.rank, p.text_len, p.tokens,
+           -- min-max over every match in the bucket; bm25 is lower-is-better, score is higher-is-better
+           CASE WHEN top.hi > top.lo THEN (top.hi - top.rank) / (top.hi - top.lo) ELSE 1.0 END AS score,
+           {"snippet(pages_fts, 2, ?, ?, ' … ', ?)" if snippet else "p.lead"} AS preview
+    FROM top
+    {"CROSS JOIN pages_fts ON pages_fts.rowid = top.id   -- CROSS JOIN: drive from the k winners" if snippet else ""}
+    CROSS JOIN pages p ON p.id = top.id
+    WHERE {"pages_fts MATCH ? AND" if snippet else ""}
+          top.rn <= CASE top.bucket {" ".join("WHEN ? THEN ?" for _ in buckets)} END
+    ORDER BY top.bucket, top.rank ASC
+    """
+    exprs, t0 = _compile_query(q), time.perf_counter()
+    if not exprs:
+        return []   # nothing searchable in q: never hand SQLite a MATCH that can fail
+    for i, m in enumerate(exprs):
+        args = [*BM25_WEIGHTS, *buckets, m, *([SNIPPET_MARK, SNIPPET_MARK, SNIPPET_TOKENS, m] if snippet else []),
+                *(x for b in buckets for x in (b, want[b]))]
+        try:
+            rows = list(db().execute(sql, args))
+            _record("fts", t0, len(rows))
+            _slow("fts", t0, [(sql, args)], query=q, match=m, k=want, rows=len(rows))
+            return rows
+        except sqlite3.OperationalError:
+            if i == len(exprs) - 1:
+                raise   # the quoted free-text form failing is a real DB error
+            log.debug("FTS5 rejected %r, retrying as free text", m)
+    return []
+
+# ---------- Retrieval core (blocking; runs on the pool) ----------
+def _search(q: str, k_components: int, k_patterns: int, k_typedoc: int, raw_scores: bool = False) -> Dict[str, Any]:
+    ks = {"components.api": k_components, "components.usage": k_components,
+          "patterns": k_patterns, "typedoc": k_typedoc}
+    buckets: Dict[str, List[Dict[str, Any]]] = {b: [] for b in BUCKETS}
+    rows = _fts(q, ks)
+    t0 = time.perf_counter()
+    for r in rows:
+        hit = {"url": r["url"], "title": r["title"], "score": round(r["score"], 4), "text_preview": _short(r["preview"]),
+               "text_len": r["text_len"] or 0, "tokens": r["tokens"] or 0}
+        if raw_scores:
+            hit["bm25"] = r["rank"]
+        buckets[r["bucket"]].append(hit)
+    _record("bucket_preview", t0)
 
-# ---------- MCP tools ----------
-@mcp.tool()
-def search(q: str, k_components: int = 1, k_patterns: int = 5, k_typedoc: int = 3) -> Dict[str, Any]:
-    superset = _fts(q, limit=max(50, k_components*6 + k_patterns*6 + k_typedoc*6))
-    buckets = {"components.api": [], "components.usage": [], "patterns": [], "typedoc": []}
-    for r in superset:
-        hit = {"url": r["url"], "title": r["title"], "text_preview": _short(r["text"]), "text_len": len(r["text"] or "")}
-        b = _bucket(hit["url"])
-        if b in buckets:
-            buckets[b].append(hit)
-
-    def top(xs, k): return xs[:max(0, k)] if k >= 0 else []
     return {
         "query": q,
         "components": {
-            "api":   top(buckets["components.api"],   k_components),
-            "usage": top(buckets["components.usage"], k_components),
+            "api":   buckets["components.api"],
+            "usage": buckets["components.usage"],
         },
-        "patterns": top(buckets["patterns"], k_patterns),
-        "typedoc":  top(buckets["typedoc"],  k_typedoc),
+        "patterns": buckets["patterns"],
+        "typedoc":  buckets["typedoc"],
         "used_rag": True,
-        "pack_id": _sha10(q),
+        "pack_id": _pack_id("search", q, *(max(0, k) for k in (k_components, k_patterns, k_typedoc)), raw_scores),
     }
 
-@mcp.tool()
-def page(url: str) -> Dict[str, Any]:
-    row = db().execute("SELECT id,url,title,text FROM pages WHERE url=? LIMIT 1", (url,)).fetchone()
-    if not row and url.startswith("typedoc://"):
-        row = db().execute("SELECT id,url,title,text FROM pages WHERE url=? LIMIT 1", (url.replace("typedoc://",""),)).fetchone()
+def _search_many(qs: List[str], k_components: int, k_patterns: int, k_typedoc: int,
+                 raw_scores: bool = False) -> List[Dict[str, Any]]:
+    return [_search(q, k_components, k_patterns, k_typedoc, raw_scores) for q in qs]
+
+def _pages(urls: List[str]) -> List[Dict[str, Any]]:
+    """Resolve many URLs with one IN (...) query, including the typedoc:// fallback."""
+    cands = {u: [u] + ([u.replace("typedoc://", "")] if u.startswith("typedoc://") else []) for u in urls}
+    keys, t0 = sorted({c for cs in cands.values() for c in cs}), time.perf_counter()
+    sql = f"SELECT id,url,title,hash,text FROM pages WHERE url IN ({','.join('?' * len(keys))})"
+    rows = {r["url"]: r for r in db().execute(sql, keys)}
+    _record("pages", t0, len(rows))
+    _slow("pages", t0, [(sql, keys)], urls=urls, rows=len(rows))
+    out = []
+    for u in urls:
+        row = next((rows[c] for c in cands[u] if c in rows), None)
+        if not row:
+            out.append({"error": "NOT_FOUND", "url": u, "used_rag": True})
+            continue
+        out.append({"id": row["id"], "url": row["url"], "title": row["title"], "text": row["text"], "etag": row["hash"],
+                    "used_rag": True, "pack_id": _pack_id("page", row["url"])})
+    return out
+
+def _page(url: str) -> Dict[str, Any]:
+    return _pages([url])[0]
+
+def _page_range(url: str, offset: int, limit: int, heading: str | None, toc: bool) -> Dict[str, Any]:
+    """Slice of a page by character offset/limit or by heading, using the indexer's `sections` offsets."""
+    keys, t0 = [url] + ([url.replace("typedoc://", "")] if url.startswith("typedoc://") else []), time.perf_counter()
+    lookup = (f"SELECT id,url,title,hash,text_len FROM pages WHERE url IN ({','.join('?' * len(keys))}) "
+              "ORDER BY url = ? DESC LIMIT 1", (*keys, url))
+    row = db().execute(*lookup).fetchone()
     if not row:
         return {"error": "NOT_FOUND", "url": url, "used_rag": True}
-    return {"id": row["id"], "url": row["url"], "title": row["title"], "text": row["text"], "used_rag": True, "pack_id": _sha10(row["url"])}
+    secs = [dict(r) for r in db().execute(
+        "SELECT heading, start, stop, tokens FROM sections WHERE page_id=? ORDER BY ord", (row["id"],))]
+    lo, hi = 0, row["text_len"] or 0   # region being paged: whole page, or one section
+    if heading is not None:
+        sec = next((x for x in secs if x["heading"].lower() == heading.strip().lower()), None)
+        if sec is None:
+            return {"error": "SECTION_NOT_FOUND", "url": row["url"], "heading": heading,
+                    "headings": list(dict.fromkeys(x["heading"] for x in secs if x["heading"])), "used_rag": True}
+        lo, hi = sec["start"], sec["stop"]
+    start = min(hi, lo + max(0, offset))
+    stop = hi if limit <= 0 else min(hi, start + limit)
+    read = ("SELECT substr(text, ?, ?) FROM pages WHERE id=?", (start + 1, stop - start, row["id"]))
+    text = db().execute(*read).fetchone()[0] or ""
+    end = start + len(text)
+    _record("page_range", t0, 1 + len(secs))
+    _slow("page_range", t0, [lookup, read], urls=[url], offset=offset, limit=limit, heading=heading,
+          rows=1 + len(secs))
+    out = {"id": row["id"], "url": row["url"], "title": row["title"], "text": text, "etag": row["hash"],
+           "offset": start, "text_len": row["text_len"],
+           # continuation cursor, relative to the region: pass back as `offset` (with the same heading)
+           "next_offset": end - lo if end < hi else None,
+           "used_rag": True, "pack_id": _pack_id("page", row["url"], start, end, toc)}
+    if toc:
+        out["sections"] = [{"heading": x["heading"], "offset": x["start"], "length": x["stop"] - x["start"],
+                            "tokens": x["tokens"]} for x in secs]
+    return out
+
+BUCKET_WEIGHT = {"components.api": 1.0, "components.usage": 0.9, "patterns": 0.7, "typedoc": 0.6}
+
+def _context(q: str, hits: List[Dict[str, Any]], token_budget: int, ks: tuple[int, ...]) -> Dict[str, Any]:
+    """Pack the most relevant sections of the hit pages into `token_budget`, using the indexer's
+    per-section token counts.
+
+    Sections are ranked by query-term matches (headings count triple, bodies are length-normalized)
+    weighted by the page's score and bucket; sections that match nothing come after, in page order.
+    Identical sections (shared boilerplate) are kept once.
+    """
+    t0 = time.perf_counter()
+    terms = {w.lower() for w in _WORD_RE.findall(q) if w not in _FTS_OPERATORS and len(w) > 1}
+    urls = [h["url"] for h in hits]
+    rows = {r["url"]: r for r in db().execute(
+        f"SELECT id, url, title, text FROM pages WHERE url IN ({','.join('?' * len(urls))})", urls)}
+    ids = [r["id"] for r in rows.values()]
+    secs: Dict[int, List[sqlite3.Row]] = {}
+    for s in db().execute(f"SELECT page_id, ord, heading, start, stop, tokens FROM sections "
+                          f"WHERE page_id IN ({','.join('?' * len(ids))}) ORDER BY page_id, ord", ids):
+        secs.setdefault(s["page_id"], []).append(s)
+    cands = []
+    for rank, h in enumerate(hits):
+        row = rows.get(h["url"])
+        if row is None:
+            continue
+        weight = (1 + h["score"]) * BUCKET_WEIGHT[h["bucket"]]
+        for s in secs.get(row["id"], []):
+            text = row["text"][s["start"]:s["stop"]].strip()
+            if not text:
+                continue
+            words = _WORD_RE.findall(text.lower())
+            head = {w.lower() for w in _WORD_RE.findall(s["heading"] or "")}
+            rel = 3 * len(terms & head) + sum(w in terms for w in words) / (1 + len(words) / 200)
+            rel += 0.5 if s["ord"] == 0 else 0   # the lead-in says what the page is
+            cands.append({"priority": (rel > 0, rel * weight, -rank, -s["ord"]), "rank": rank, "ord": s["ord"],
+                          "url": row["url"], "title": row["title"], "bucket": h["bucket"], "heading": s["heading"],
+                          "offset": s["start"], "tokens": s["tokens"], "text": text})
+    cands.sort(key=lambda c: c["priority"], reverse=True)
+    picked, seen, used = [], set(), 0
+    for c in cands:
+        digest = hashlib.sha1(" ".join(c["text"].lower().split()).encode("utf-8")).digest()
+        if digest in seen:
+            continue
+        if used + c["tokens"] > token_budget:
+            if picked or used >= token_budget:
+                continue
+            # not even the best section fits: send its head rather than nothing
+            c["text"], c["tokens"], c["truncated"] = c["text"][:token_budget * 4], token_budget, True
+        seen.add(digest)
+        picked.append(c)
+        used += c["tokens"]
+    _record("context", t0, len(rows) + sum(len(v) for v in secs.values()))
+    # reading order: API -> Usage -> Patterns -> TypeDoc (search rank), then document order
+    picked.sort(key=lambda c: (c["rank"], c["ord"]))
+    for c in picked:
+        del c["priority"], c["rank"], c["ord"]
+    return {"query": q, "token_budget": token_budget, "tokens": used, "sections": picked,
+            "sources": list(dict.fromkeys(c["url"] for c in picked)), "omitted": len(cands) - len(picked),
+            "used_rag": True, "pack_id": _pack_id("context", q, token_budget, *ks)}
+
+# ---------- Autocomplete ----------
+# Sorted (key, label) array over component names and page titles. Every word start of a label
+# is a key, so "nav" finds "Side navigation". Rebuilt when the index generation changes.
+_suggest: tuple[str, List[str], List[str], Dict[str, Dict[str, str]]] = ("", [], [], {})
+
+def _load_suggestions() -> tuple[List[str], List[str], Dict[str, Dict[str, str]]]:
+    entries: Dict[str, Dict[str, str]] = {}
+    # components.api sorts first, so component names link to their API tab
+    for r in db().execute("SELECT url, title, bucket FROM pages WHERE bucket IS NOT NULL ORDER BY bucket, url"):
+        m = re.search(r"/components/([^/?#]+)", r["url"])
+        label = m.group(1).replace("-", " ").capitalize() if m else (r["title"] or r["url"])
+        entries.setdefault(label.lower(), {"label": label, "url": r["url"], "bucket": r["bucket"]})
+    pairs = sorted({(low[m.start():], low) for low in entries for m in re.finditer(r"\w+", low)})
+    return [k for k, _ in pairs], [low for _, low in pairs], entries
+
+async def _suggestions() -> tuple[List[str], List[str], Dict[str, Dict[str, str]]]:
+    global _suggest
+    gen = _generation()
+    if _suggest[0] != gen or not _suggest[3]:
+        _suggest = (gen, *await _run(_load_suggestions))
+    return _suggest[1:]
+
+def _complete(keys: List[str], labels: List[str], entries: Dict[str, Dict[str, str]],
+              prefix: str, limit: int) -> List[Dict[str, str]]:
+    p = " ".join(prefix.lower().split())
+    if not p:
+        return []
+    hits: Dict[str, None] = {}
+    i = bisect.bisect_left(keys, p)
+    while i < len(keys) and keys[i].startswith(p) and len(hits) < limit * 4:
+        hits.setdefault(labels[i])
+        i += 1
+    # whole-label prefix matches first, then shorter labels
+    best = sorted(hits, key=lambda low: (not low.startswith(p), len(low), low))
+    return [entries[low] for low in best[:limit]]
+
+# ---------- MCP tools ----------
+@mcp.tool()
+@_instrumented
+async def search(q: str, k_components: int = 1, k_patterns: int = 5, k_typedoc: int = 3,
+                 raw_scores: bool = False) -> Dict[str, Any]:
+    """BM25 search grouped into buckets. Each hit has `score` in [0,1] (min-max per bucket, 1 = best);
+    `raw_scores=True` adds the raw `bm25` value (lower = better)."""
+    q = " ".join(q.split())
+    if ACCESS_LOG and not _replaying.get():
+        access_log.info(json.dumps({"ts": round(time.time(), 3), "tool": "search", "q": q,
+                                    "k": [max(0, k) for k in (k_components, k_patterns, k_typedoc)],
+                                    "raw": raw_scores}, ensure_ascii=False))
+    return await _cached_search(q, k_components, k_patterns, k_typedoc, raw_scores)
+
+async def _cached_search(q: str, k_components: int, k_patterns: int, k_typedoc: int, raw_scores: bool,
+                         idx: _Index | None = None) -> Dict[str, Any]:
+    idx = idx or _current
+    key = (idx.generation, q, max(0, k_components), max(0, k_patterns), max(0, k_typedoc), raw_scores)
+    res = _search_cache.get(key)
+    if res is None:
+        res = await _run_on(idx, _search, q, k_components, k_patterns, k_typedoc, raw_scores)
+        _search_cache.put(key, res)
+    return _keep(key[0], res)
+
+@mcp.tool()
+@_instrumented
+async def page(url: str, if_none_match: str | None = None, offset: int = 0, limit: int = 0,
+               heading: str | None = None, toc: bool = False) -> Dict[str, Any]:
+    """Page text. Pass a previously returned `etag` as `if_none_match` to skip the text when unchanged.
+
+    For large pages, `limit` (chars) and/or `heading` return a slice plus `next_offset` to continue from
+    (offsets are relative to the heading's section when one is given); `toc=True` lists the page's
+    headings with offsets and token counts. A slice's `etag` is its page's, so `if_none_match` works
+    for the same slice too.
+    """
+    if offset or limit or heading is not None or toc:
+        res = _keep(_generation(), await _run(_page_range, url, offset, limit, heading, toc))
+    else:
+        key = (_generation(), url)
+        if ACCESS_LOG and not _replaying.get():
+            access_log.info(json.dumps({"ts": round(time.time(), 3), "tool": "page", "url": url}, ensure_ascii=False))
+        res = _page_cache.get(key)
+        if res is None:
+            res = await _run(_page, url)
+            _page_cache.put(key, res)
+        _keep(key[0], res)
+    if if_none_match and res.get("etag") and if_none_match.strip('"') == res["etag"]:
+        return {"url": res["url"], "etag": res["etag"], "not_modified": True, "used_rag": True, "pack_id": res["pack_id"]}
+    return res
+
+@mcp.tool()
+@_instrumented
+async def search_many(queries: List[str], k_components: int = 1, k_patterns: int = 5, k_typedoc: int = 3,
+                      raw_scores: bool = False) -> Dict[str, Any]:
+    """Run several searches in one call; results are returned in query order."""
+    if len(queries) > MAX_BATCH:
+        return {"error": "BATCH_TOO_LARGE", "max": MAX_BATCH, "used_rag": True}
+    gen, ks = _generation(), (max(0, k_components), max(0, k_patterns), max(0, k_typedoc), raw_scores)
+    qs = [" ".join(q.split()) for q in queries]
+    found = {q: _search_cache.get((gen, q, *ks)) for q in dict.fromkeys(qs)}
+    misses = [q for q, r in found.items() if r is None]
+    if misses:
+        for q, res in zip(misses, await _run(_search_many, misses, k_components, k_patterns, k_typedoc, raw_scores)):
+            _search_cache.put((gen, q, *ks), res)
+            found[q] = res
+    return {"results": [_keep(gen, found[q]) for q in qs], "used_rag": True}
+
+@mcp.tool()
+@_instrumented
+async def pages(urls: List[str]) -> Dict[str, Any]:
+    """Fetch several pages in one call; results are returned in url order."""
+    if len(urls) > MAX_BATCH:
+        return {"error": "BATCH_TOO_LARGE", "max": MAX_BATCH, "used_rag": True}
+    gen = _generation()
+    found = {u: _page_cache.get((gen, u)) for u in dict.fromkeys(urls)}
+    misses = [u for u, r in found.items() if r is None]
+    if misses:
+        for u, res in zip(misses, await _run(_pages, misses)):
+            _page_cache.put((gen, u), res)
+            found[u] = res
+    return {"pages": [_keep(gen, found[u]) for u in urls], "used_rag": True}
+
+@mcp.tool()
+@_instrumented
+async def context(q: str, token_budget: int = 4000, k_components: int = 1, k_patterns: int = 3,
+                  k_typedoc: int = 2) -> Dict[str, Any]:
+    """One-call context for an agent: searches, then packs the most relevant sections of the top
+    API/Usage/Patterns/TypeDoc hits (deduplicated) into `token_budget` tokens (≈ chars/4).
+
+    Sections come back in API -> Usage -> Patterns -> TypeDoc order with their `url`, `heading` and
+    `offset`, ready to cite; continue reading any of them with `page(url, heading=...)`.
+    """
+    q, token_budget = " ".join(q.split()), max(1, token_budget)
+    ks = tuple(max(0, k) for k in (k_components, k_patterns, k_typedoc))
+    # search, packing and cache key all use one generation, even if the index is swapped meanwhile;
+    # the pin keeps a retired index open between the two calls
+    idx = _current
+    idx.active += 1
+    try:
+        key = (idx.generation, "context", q, token_budget, *ks)
+        out = _search_cache.get(key)
+        if out is None:
+            res = await _cached_search(q, *ks, False, idx)
+            hits: Dict[str, Dict[str, Any]] = {}   # url -> first (best-bucket) hit
+            for b, hs in (("components.api", res["components"]["api"]), ("components.usage", res["components"]["usage"]),
+                          ("patterns", res["patterns"]), ("typedoc", res["typedoc"])):
+                for h in hs:
+                    hits.setdefault(h["url"], {**h, "bucket": b})
+            out = await _run_on(idx, _context, q, list(hits.values()), token_budget, ks)
+            _search_cache.put(key, out)
+    finally:
+        idx.release()
+    return _keep(key[0], out)
+
+@mcp.tool()
+@_instrumented
+async def suggest(prefix: str, limit: int = MAX_SUGGEST) -> Dict[str, Any]:
+    """Autocomplete component names and page titles from an in-memory sorted index (no BM25 query)."""
+    keys, labels, entries = await _suggestions()
+    return {"prefix": prefix, "suggestions": _complete(keys, labels, entries, prefix, max(1, min(limit, 50))),
+            "used_rag": True}
+
+@mcp.tool()
+@_instrumented
+async def get_pack(pack_id: str) -> Dict[str, Any]:
+    """Result of an earlier search/search_many/page/pages call by its `pack_id`, without re-running retrieval
+    (e.g. to hand context to a sub-agent). `stale=True` means the index has been rebuilt since."""
+    e = _packs.get(pack_id.strip())
+    if e is None:
+        return {"error": "PACK_NOT_FOUND", "pack_id": pack_id, "used_rag": True}
+    gen, res = e
+    return {**res, "generation": gen, "stale": gen != _generation()}
+
+# ---------- Index hot-swap ----------
+PAGE_COLUMNS = ("id", "url", "title", "section", "bucket", "text_len", "tokens", "lead", "hash", "headings", "text")
+FTS_PROBE = "SELECT rowid FROM pages_fts WHERE pages_fts MATCH 'component*' LIMIT 1"
+
+def _validate() -> Dict[str, int]:
+    """Schema + FTS probe for a candidate index; raises if it cannot serve this version of the server."""
+    c = db()
+    names = {r[0] for r in c.execute("SELECT name FROM sqlite_master")}
+    cols = {r[1] for r in c.execute("PRAGMA table_info(pages)")}
+    missing = [t for t in ("pages", "pages_fts", "sections", "meta") if t not in names]
+    missing += [f"pages.{col}" for col in PAGE_COLUMNS if "pages" in names and col not in cols]
+    if missing:
+        raise RuntimeError(f"index schema mismatch, missing: {', '.join(missing)}")
+    c.execute(FTS_PROBE).fetchall()
+    return {"pages": c.execute("SELECT COUNT(*) FROM pages").fetchone()[0]}
+
+_swap_lock = asyncio.Lock()
+_refill: set[asyncio.Task] = set()   # strong refs to post-swap cache refills
+
+async def _sync_workers() -> None:
+    """Point the pool at the current index. _Index.close() only reaches this process's connections, so
+    with DB_WORKERS>1 every worker process closes its own (an idle one would otherwise keep a replaced
+    or rejected file open until its next call); pool threads just open the new index before traffic does."""
+    if DB_WORKERS > 1:
+        await asyncio.gather(*(_run(_drop_retired) for _ in range(DB_WORKERS)))
+        if _worker_barrier.broken:
+            _worker_barrier.reset()
+    else:
+        await asyncio.gather(*(_run(_open) for _ in range(DB_POOL_SIZE)))
+
+async def _swap(path: str) -> Dict[str, Any]:
+    """Open `path` in the background, validate and warm it, then point new queries at it.
+
+    Calls already running keep their connection to the old index, which is closed once
+    they drain; SSE sessions are unaffected.
+    """
+    global _current, _suggest
+    async with _swap_lock:
+        new = await asyncio.to_thread(_Index, path)
+        if not new.generation:
+            raise RuntimeError(f"DB not found: {path}")
+        if new.generation == _current.generation and new.path == _current.path:
+            _current.ident = new.ident
+            return {"swapped": False, "generation": new.generation}
+        try:
+            if DB_IN_MEMORY:
+                await asyncio.to_thread(new.load_memdb)
+            elif WARMUP:
+                await asyncio.to_thread(_read_file, path)
+            info = await _run_on(new, _validate)
+            sugg = await _run_on(new, _load_suggestions)
+        except Exception:
+            new.close()
+            await _sync_workers()
+            raise
+        old, _current = _current, new
+        _suggest = (new.generation, *sugg)
+        _search_cache.clear()
+        _page_cache.clear()
+        old.retire()
+        await _sync_workers()
+        log.info("Swapped index %s (%s) -> %s (%s), %d pages",
+                 old.path, old.generation, new.path, new.generation, info["pages"])
+        if WARMUP:   # refill the (now empty) caches with the hot calls in the background
+            _refill.add(task := asyncio.create_task(_replay(await asyncio.to_thread(_hot_calls))))
+            task.add_done_callback(_refill.discard)
+        return {"swapped": True, "generation": new.generation, "previous": old.generation, **info}
+
+async def _watch_index() -> None:
+    """Hot-swap when the served index file is replaced (build elsewhere, then `mv` into place)."""
+    while True:
+        await asyncio.sleep(INDEX_WATCH_INTERVAL)
+        path = _current.path
+        if _file_ident(path) in ("", _current.ident):
+            continue
+        try:
+            await _swap(path)
+        except Exception as e:   # keep serving the old index
+            log.warning("Index reload of %s failed: %s", path, e)
+            _current.ident = _file_ident(path)   # don't retry until the file changes again
 
 # ---------- ASGI (SSE MCP) ----------
 async def health(_request):
-    ok = os.path.exists(DB_PATH)
-    return JSONResponse({"ok": ok, "db_path": DB_PATH})
+    ok = os.path.exists(_current.path)
+    return JSONResponse({"ok": ok, "db_path": _current.path, "generation": _generation(),
+                         "cache": {"search": _search_cache.stats(), "page": _page_cache.stats(), "pack": _packs.stats()},
+                         "workers": {w: {"calls": int(v["calls"]), "busy_s": round(v["busy_s"], 3)}
+                                     for w, v in sorted(_worker_stats.items())}})
+
+async def metrics(_request):
+    lines = [*_tool_calls.render(), *_tool_latency.render(), *_tool_bytes.render(),
+             *_stage_latency.render(), *_stage_rows.render()]
+    caches = {"search": _search_cache.stats(), "page": _page_cache.stats(), "pack": _packs.stats()}
+    lines += ["# HELP cloudscape_cache_requests_total Cache lookups by result.", "# TYPE cloudscape_cache_requests_total counter"]
+    lines += [f'cloudscape_cache_requests_total{{cache="{c}",result="{r}"}} {st[key]}'
+              for c, st in caches.items() for r, key in (("hit", "hits"), ("miss", "misses"))]
+    for name, key, help in (("cloudscape_cache_hit_ratio", "hit_ratio", "Hits / lookups since start."),
+                            ("cloudscape_cache_entries", "entries", "Cached entries."),
+                            ("cloudscape_cache_bytes", "bytes", "Cached JSON bytes.")):
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge",
+                  *(f'{name}{{cache="{c}"}} {st[key]}' for c, st in caches.items())]
+    lines += ["# HELP cloudscape_db_calls_total DB calls per pool thread / worker process.",
+              "# TYPE cloudscape_db_calls_total counter",
+              *(f"cloudscape_db_calls_total{_fmt_labels((('worker', w),))} {int(v['calls'])}"
+                for w, v in sorted(_worker_stats.items())),
+              "# HELP cloudscape_db_busy_seconds_total Time spent in DB calls per pool thread / worker process.",
+              "# TYPE cloudscape_db_busy_seconds_total counter",
+              *(f"cloudscape_db_busy_seconds_total{_fmt_labels((('worker', w),))} {v['busy_s']}"
+                for w, v in sorted(_worker_stats.items()))]
+    lines += ["# HELP cloudscape_sse_sessions_active Open MCP SSE streams.", "# TYPE cloudscape_sse_sessions_active gauge",
+              f"cloudscape_sse_sessions_active {_sse_sessions}", *_sse_sessions_total.render(),
+              "# HELP cloudscape_index_info Index generation being served.", "# TYPE cloudscape_index_info gauge",
+              f"cloudscape_index_info{_fmt_labels((('generation', _generation()),))} 1"]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+# ---------- Warmup ----------
+_warmup: Dict[str, Any] = {"state": "pending"}   # pending -> running -> done
+
+def _read_file(path: str) -> int:
+    """Read the index once so its pages sit in the OS page cache (and the mmap) before traffic."""
+    n = 0
+    with open(path, "rb", buffering=0) as f:
+        while chunk := f.read(1 << 20):
+            n += len(chunk)
+    return n
+
+def _hot_calls() -> List[tuple[str, tuple]]:
+    """Calls to replay: WARMUP_QUERIES, then the most frequent search/page calls in ACCESS_LOG."""
+    calls: List[tuple[str, tuple]] = []
+    if WARMUP_QUERIES and os.path.exists(WARMUP_QUERIES):
+        with open(WARMUP_QUERIES, encoding="utf-8") as f:
+            calls += [("search", (" ".join(l.split()), 1, 5, 3, False))   # search() defaults
+                      for l in f if l.strip() and not l.startswith("#")]
+    if ACCESS_LOG and os.path.exists(ACCESS_LOG):
+        with open(ACCESS_LOG, "rb") as f:
+            f.seek(max(0, os.path.getsize(ACCESS_LOG) - (16 << 20)))   # recent tail is enough
+            lines = f.read().decode("utf-8", "replace").splitlines()
+        seen: Counter[tuple[str, tuple]] = Counter()
+        for line in lines:
+            try:
+                e = json.loads(line)
+                seen[("search", (e["q"], *e["k"], e["raw"])) if e["tool"] == "search" else ("page", (e["url"],))] += 1
+            except (ValueError, KeyError, TypeError):
+                continue   # partial first line of the tail, or a foreign line
+        calls += [c for c, _ in seen.most_common()]
+    return list(dict.fromkeys(calls))[:WARMUP_TOP]
+
+async def _replay(calls: List[tuple[str, tuple]]) -> int:
+    """Run calls through the tools (filling the search/page caches and every pool connection's
+    statement cache), bypassing metrics and the access log; returns how many failed."""
+    sem = asyncio.Semaphore(max(DB_WORKERS, DB_POOL_SIZE))
+    _replaying.set(True)   # copied into the tasks gather() creates; this coroutine's own context
+
+    async def one(tool: str, args: tuple) -> None:
+        async with sem:
+            await (search if tool == "search" else page).__wrapped__(*args)
+    res = await asyncio.gather(*(one(*c) for c in calls), return_exceptions=True)
+    return sum(isinstance(r, Exception) for r in res)
+
+async def _warm() -> None:
+    t0 = time.perf_counter()
+    _warmup["state"] = "running"
+    try:
+        if os.path.exists(_current.path):
+            if not DB_IN_MEMORY:
+                _warmup["db_read_mib"] = round(await asyncio.to_thread(_read_file, _current.path) / (1 << 20), 1)
+            calls = await asyncio.to_thread(_hot_calls)
+            _warmup.update(calls=len(calls), failed=await _replay(calls))
+    except Exception as e:   # a failed warmup must not keep the pod unready forever
+        log.warning("Warmup failed: %s", e)
+        _warmup["error"] = str(e)
+    _warmup.update(state="done", seconds=round(time.perf_counter() - t0, 3))
+    log.info("Warmup done: %s", _warmup)
+
+# ---------- Liveness / readiness ----------
+_ready: Dict[str, Any] = {"at": float("-inf"), "generation": None, "probe": {}}
+
+def _probe() -> Dict[str, Any]:
+    """FTS round trip plus the indexer's manifest (a primary-key lookup, never COUNT(*))."""
+    c, t0 = db(), time.perf_counter()
+    c.execute(FTS_PROBE).fetchall()
+    ms = round((time.perf_counter() - t0) * 1000, 3)
+    try:
+        row = c.execute("SELECT value FROM meta WHERE key='manifest'").fetchone()
+    except sqlite3.OperationalError:
+        row = None   # index built before `meta`
+    return {"fts_ms": ms, "manifest": json.loads(row[0]) if row else None}
+
+async def livez(_request):
+    return JSONResponse({"ok": True})
+
+async def readyz(_request):
+    """200 once warmup is done and the served index answers an FTS query; the probe result is
+    reused for READY_PROBE_TTL seconds (and redone right after an index swap)."""
+    gen = _generation()
+    if time.monotonic() - _ready["at"] > READY_PROBE_TTL or _ready["generation"] != gen:
+        try:
+            probe = {"ok": True, **await _run(_probe)}
+        except Exception as e:
+            probe = {"ok": False, "error": str(e)}
+        _ready.update(at=time.monotonic(), generation=gen, probe=probe)
+    probe = _ready["probe"]
+    ready = probe["ok"] and _warmup["state"] == "done"
+    return JSONResponse({"ready": ready, "generation": gen, "warmup": _warmup,
+                         "probe_age_s": round(time.monotonic() - _ready["at"], 3), **probe},
+                        status_code=200 if ready else 503)
+
+async def admin_reload(request):
+    if not ADMIN_TOKEN or request.headers.get("authorization") != f"Bearer {ADMIN_TOKEN}":
+        return JSONResponse({"error": "FORBIDDEN"}, status_code=403)
+    body = await request.json() if await request.body() else {}
+    try:
+        return JSONResponse(await _swap(body.get("path") or _current.path))
+    except Exception as e:
+        return JSONResponse({"error": "RELOAD_FAILED", "detail": str(e)}, status_code=409)
+
+# ---------- REST (no MCP session) ----------
+def _etag(*parts: Any) -> str:
+    """Weak validator: the same tag covers the br, gzip and identity encodings of a response."""
+    return 'W/"' + _sha10("\x1f".join(map(str, parts))) + '"'
+
+def _not_modified(request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match", "")
+    return inm.strip() == "*" or etag.removeprefix("W/") in (t.strip().removeprefix("W/") for t in inm.split(","))
+
+def _json(request, res: Dict[str, Any], etag: str | None = None, status: int = 200) -> Response:
+    """JSON response, brotli/gzip-encoded when the client accepts it and the body is worth it."""
+    headers = {"vary": "Accept-Encoding"}
+    if etag:
+        headers["etag"] = etag
+    body = json.dumps(res, ensure_ascii=False, separators=(",", ":")).encode()
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accept = {t.split(";")[0].strip() for t in request.headers.get("accept-encoding", "").split(",")}
+        if brotli is not None and "br" in accept:
+            body, headers["content-encoding"] = brotli.compress(body, quality=4), "br"
+        elif "gzip" in accept:
+            body, headers["content-encoding"] = gzip.compress(body, compresslevel=5), "gzip"
+    return Response(body, status_code=status, media_type="application/json", headers=headers)
+
+async def rest_search(request):
+    """POST /search {"q", "k_components", "k_patterns", "k_typedoc", "raw_scores"} -> search()."""
+    try:
+        body = await request.json()
+        q = body["q"]
+        ks = [int(body.get(k, d)) for k, d in (("k_components", 1), ("k_patterns", 5), ("k_typedoc", 3))]
+        raw = bool(body.get("raw_scores", False))
+        if not isinstance(q, str):
+            raise TypeError
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JSONResponse({"error": "BAD_REQUEST", "detail": 'expected JSON {"q": "...", "k_*": int}'},
+                            status_code=400)
+    # the ETag depends only on the request and the index generation: revalidation never touches the DB
+    etag = _etag(_generation(), " ".join(q.split()), *(max(0, k) for k in ks), raw)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"etag": etag, "vary": "Accept-Encoding"})
+    return _json(request, await search(q, *ks, raw_scores=raw), etag)
+
+async def rest_page(request):
+    """GET /page?url=...[&offset&limit&heading&toc] -> page(); conditional on page hash + generation."""
+    p = request.query_params
+    try:
+        url = p["url"]
+        offset, limit = int(p.get("offset", 0)), int(p.get("limit", 0))
+    except (KeyError, ValueError):
+        return JSONResponse({"error": "BAD_REQUEST", "detail": "expected ?url=...&offset=int&limit=int"}, status_code=400)
+    heading, toc = p.get("heading"), p.get("toc", "").lower() in ("1", "true", "yes")
+    gen = _generation()
+    res = await page(url, None, offset, limit, heading, toc)
+    if "error" in res:
+        return _json(request, res, status=404 if res["error"].endswith("NOT_FOUND") else 400)
+    etag = _etag(gen, res["etag"], offset, limit, heading, toc)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"etag": etag, "vary": "Accept-Encoding"})
+    return _json(request, res, etag)
 
 # Build FastMCP's SSE app with its default endpoints:
 #   GET  /sse            (event stream)
 #   POST /messages/      (backchannel)
 sse_app = mcp.sse_app()  # no custom paths => defaults to /sse and /messages/
+# Streamable HTTP (stateless, JSON responses):
+#   POST MCP_HTTP_PATH   (one JSON-RPC request -> one JSON response)
+http_app = mcp.streamable_http_app() if MCP_HTTP_PATH else None
+# In stateless mode the SDK logs a ClosedResourceError traceback after every request whose
+# transport it has already torn down (the response is sent fine); keep it out of the logs.
+logging.getLogger("mcp.server.streamable_http").addFilter(
+    lambda r: not (r.exc_info and type(r.exc_info[1]).__name__ == "ClosedResourceError"))
 
 # Compose the parent Starlette app.
-# Mount SSE app at ROOT so its own routes (/sse, /messages/) are exact.
-app = Starlette()
-app.mount("/", sse_app)
+# Routes match in order: register ours first, then mount the SSE app at ROOT
+# so its own routes (/sse, /messages/) are exact.
+@asynccontextmanager
+async def lifespan(_app):
+    if os.path.exists(_current.path):
+        if DB_IN_MEMORY:
+            await asyncio.to_thread(_current.load_memdb)
+        # concurrent submits spawn every worker process (and open its connection) before traffic
+        await asyncio.gather(*(_run(_open) for _ in range(max(DB_WORKERS, 1))))
+        await _suggestions()   # load the autocomplete array before serving
+    # warm in the background: /livez answers meanwhile, /readyz waits for it
+    warm = asyncio.create_task(_warm()) if WARMUP else None
+    if warm is None:
+        _warmup["state"] = "done"
+    watcher = asyncio.create_task(_watch_index()) if INDEX_WATCH_INTERVAL > 0 else None
+    async with (mcp.session_manager.run() if http_app else nullcontext()):
+        yield
+    for task in (watcher, warm):
+        if task is not None:
+            task.cancel()
+    if _procs is not None:
+        _procs.shutdown(cancel_futures=True)
+
+app = Starlette(lifespan=lifespan)
 app.add_route("/health", health, methods=["GET"])
+app.add_route("/livez", livez, methods=["GET"])
+app.add_route("/healthz", livez, methods=["GET"])
+app.add_route("/readyz", readyz, methods=["GET"])
+app.add_route("/metrics", metrics, methods=["GET"])
+app.add_route("/admin/reload", admin_reload, methods=["POST"])
+app.add_route("/search", rest_search, methods=["POST"])
+app.add_route("/page", rest_page, methods=["GET"])
+if http_app:
+    for r in http_app.routes:
+        r.app = _meter_tools(r.app)
+    app.router.routes.extend(http_app.routes)
+app.mount("/", _track_sessions(_meter_tools(sse_app)))
 
 # CORS so MCP Inspector (browser) can preflight/connect
 app.add_middleware(
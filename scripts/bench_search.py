@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark for the retrieval tools (no crawl, no network):
+- build:   synthetic index.db of N pages across the four buckets, written with the real
+           indexer code (create_schema / upsert_page), so schema, FTS and metadata match `make index`
+- run:     replay a query corpus against main.search / main.page in-process at several
+           concurrency levels; reports p50/p95/p99 latency and QPS, emits JSON
+- compare: diff two JSON results (e.g. before/after a commit)
+
+  python3 scripts/bench_search.py build --db build/bench.db --pages 100000
+  python3 scripts/bench_search.py run --db build/bench.db --concurrency 1,8,32 --out before.json
+  python3 scripts/bench_search.py compare before.json after.json
+"""
+
+import argparse, asyncio, json, os, platform, random, sqlite3, subprocess, sys, time, uuid
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+# ---------- Synthetic corpus ----------
+COMPONENTS = ["alert", "app layout", "attribute editor", "autosuggest", "badge", "box", "breadcrumb group", "button",
+              "button dropdown", "cards", "checkbox", "code editor", "collection preferences", "column layout",
+              "container", "content layout", "date picker", "date range picker", "drawer", "expandable section",
+              "file upload", "flashbar", "form", "form field", "grid", "header", "help panel", "icon", "input",
+              "key value pairs", "link", "modal", "multiselect", "pagination", "popover", "progress bar",
+              "property filter", "radio group", "select", "side navigation", "space between", "spinner",
+              "split panel", "status indicator", "steps", "table", "tabs", "tag editor", "text content",
+              "text filter", "textarea", "tiles", "toggle", "token group", "top navigation", "wizard"]
+PATTERN_GROUPS = ["general", "resource management", "navigation", "feedback", "forms", "data visualization"]
+HEADINGS = {"components_api": ["Properties", "Slots", "Events", "Functions"],
+            "components_usage": ["General guidelines", "Features", "Writing guidelines", "Accessibility guidelines"],
+            "patterns": ["Key UX concepts", "Building blocks", "General guidelines", "Writing guidelines"],
+            "typedoc": ["## Properties", "## Methods", "## Type declaration"]}
+COMMON = ("the a to of and in is for with on that be this can or use when are as by it an not if from you "
+          "users user component page content state value item items data action actions selected").split()
+DOMAIN = ("loading error success warning dismissible header footer filter sorting selection pagination "
+          "preferences empty resizable sticky columns keyboard focus label description placeholder disabled "
+          "readonly invalid validation async expandable nested variant primary normal icon external href "
+          "onChange onFollow onDismiss ariaLabel i18nStrings visible wrapLines trackBy stripedRows").split()
+
+
+def word_pool(rng: random.Random, rare: int) -> List[str]:
+    """Zipf-ish draw list: very common stop words, domain terms, then a long tail of rare tokens."""
+    tail = [f"tok{rng.randrange(rare):x}" for _ in range(rare // 4)]
+    return COMMON * 40 + DOMAIN * 8 + [w for c in COMPONENTS for w in c.split()] * 2 + tail
+
+
+def synth_page(rng: random.Random, pool: List[str], i: int, section: str, words: int) -> Dict[str, str]:
+    comp = rng.choice(COMPONENTS)
+    slug = comp.replace(" ", "-") + (f"-{i}" if i >= len(COMPONENTS) else "")
+    if section == "components_api":
+        url, title = f"https://cloudscape.design/components/{slug}/?tabId=api", f"{comp.capitalize()}: API"
+    elif section == "components_usage":
+        url, title = f"https://cloudscape.design/components/{slug}/?tabId=usage", f"{comp.capitalize()}: Usage"
+    elif section == "patterns":
+        url = f"https://cloudscape.design/patterns/{rng.choice(PATTERN_GROUPS).replace(' ', '-')}/{slug}/"
+        title = f"{comp.capitalize()} pattern {i}"
+    else:
+        url, title = f"typedoc://cloudscape-design__components/{slug}.md", f"{comp.replace(' ', '')}Props"
+    heads = HEADINGS[section]
+    per = max(1, words // (len(heads) + 1))
+    parts = [f"{comp} " + " ".join(rng.choices(pool, k=per))]
+    for h in heads:
+        parts.append(h + "\n" + " ".join(rng.choices(pool, k=per)))
+    return {"url": url, "title": title, "text": "\n".join(parts), "section": section}
+
+
+def build(args):
+    from build_index_bm25 import create_schema, upsert_page, write_manifest, write_meta
+    out = Path(args.db)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    for p in (out, Path(f"{out}-wal"), Path(f"{out}-shm")):
+        p.unlink(missing_ok=True)
+    rng = random.Random(args.seed)
+    pool = word_pool(rng, args.vocab)
+    mix = [("components_api", .2), ("components_usage", .2), ("patterns", .3), ("typedoc", .3)]
+
+    db = sqlite3.connect(str(out))
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL;")
+    db.execute("PRAGMA synchronous=OFF;")
+    create_schema(db)
+    t0 = time.perf_counter()
+    for i in range(args.pages):
+        section = rng.choices([s for s, _ in mix], [w for _, w in mix])[0]
+        d = synth_page(rng, pool, i, section, max(20, int(rng.gauss(args.words, args.words / 3))))
+        upsert_page(db, d["url"], d["title"], d["text"], d["section"])
+        if (i + 1) % 10000 == 0:
+            db.commit()
+            print(f"  {i + 1}/{args.pages} pages ({time.perf_counter() - t0:.0f}s)", file=sys.stderr)
+    db.commit()
+    db.execute("INSERT INTO pages_fts(pages_fts) VALUES ('optimize');")
+    write_manifest(db)
+    write_meta(db, generation=uuid.uuid4().hex, built_at=int(time.time()), synthetic=args.seed)
+    db.commit()
+    db.execute("PRAGMA journal_mode=DELETE;")
+    n = db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+    db.close()
+    print(f"Built {n} synthetic pages -> {out} ({out.stat().st_size / (1 << 20):.1f} MiB, "
+          f"{time.perf_counter() - t0:.0f}s)")
+
+
+def default_queries(rng: random.Random, n: int) -> List[str]:
+    """Component names, name + feature, phrases, prefixes, OR queries and punctuation-heavy input."""
+    shapes = [
+        lambda: rng.choice(COMPONENTS),
+        lambda: f"{rng.choice(COMPONENTS)} {rng.choice(DOMAIN)}",
+        lambda: f'"{rng.choice(COMPONENTS)}" AND {rng.choice(DOMAIN)}',
+        lambda: rng.choice(DOMAIN)[:3] + "*",
+        lambda: f"{rng.choice(DOMAIN)} OR {rng.choice(DOMAIN)}",
+        lambda: rng.choice(COMPONENTS).replace(" ", "-") + "?",
+        lambda: rng.choice(COMMON),
+    ]
+    return [rng.choice(shapes)() for _ in range(n)]
+
+
+# ---------- Replay ----------
+def pct(xs: List[float], p: float) -> float:
+    return round(xs[min(len(xs) - 1, int(p * len(xs)))] * 1000, 3) if xs else 0.0
+
+
+def summarize(lat: List[float]) -> Dict[str, Any]:
+    xs = sorted(lat)
+    return {"requests": len(xs), "p50_ms": pct(xs, .50), "p95_ms": pct(xs, .95), "p99_ms": pct(xs, .99),
+            "mean_ms": round(sum(xs) / len(xs) * 1000, 3) if xs else 0.0}
+
+
+async def replay(main, ops: List[tuple], concurrency: int) -> Dict[str, Any]:
+    lat: Dict[str, List[float]] = {"search": [], "page": []}
+    errors = 0
+    it = iter(ops)
+
+    async def client():
+        nonlocal errors
+        for tool, arg in it:   # shared iterator: each op runs once
+            t0 = time.perf_counter()
+            try:
+                res = await (main.search(arg) if tool == "search" else main.page(arg))
+                errors += isinstance(res, dict) and "error" in res
+            except Exception:
+                errors += 1
+            lat[tool].append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+    return {"concurrency": concurrency, **summarize(lat["search"] + lat["page"]), "errors": errors,
+            "qps": round(len(ops) / wall, 1), "wall_s": round(wall, 3),
+            "by_tool": {t: summarize(v) for t, v in lat.items() if v}}
+
+
+def git_rev() -> str:
+    try:
+        return subprocess.run(["git", "-C", str(ROOT), "describe", "--always", "--dirty"],
+                              capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def run(args):
+    # configure main.py before importing it; caches off unless asked, so every call hits SQLite
+    os.environ["DB_PATH"] = args.db
+    if not args.cache:
+        os.environ["SEARCH_CACHE_ENTRIES"] = os.environ["PAGE_CACHE_BYTES"] = "0"
+    os.environ.setdefault("SLOW_QUERY_MS", "0")
+    import main
+
+    rng = random.Random(args.seed)
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            corpus = [l.strip() for l in f if l.strip() and not l.startswith("#")]
+    else:
+        corpus = default_queries(rng, 500)
+    with closing(sqlite3.connect(Path(args.db).resolve().as_uri() + "?mode=ro", uri=True)) as c:
+        urls = [r[0] for r in c.execute("SELECT url FROM pages ORDER BY random() LIMIT 1000")]
+        pages_n = c.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def ops(n):
+        return [("page", rng.choice(urls)) if urls and rng.random() < args.page_ratio else ("search", rng.choice(corpus))
+                for _ in range(n)]
+
+    async def go():
+        await replay(main, ops(args.warmup), 1)
+        out = []
+        for c in args.concurrency:
+            r = await replay(main, ops(args.requests), c)
+            print(f"c={c:<4} qps={r['qps']:<9} p50={r['p50_ms']}ms p95={r['p95_ms']}ms p99={r['p99_ms']}ms "
+                  f"errors={r['errors']}", file=sys.stderr)
+            out.append(r)
+        return out
+
+    try:
+        results = asyncio.run(go())
+    finally:
+        if main._procs is not None:
+            main._procs.shutdown()
+    report = {"commit": git_rev(), "ts": int(time.time()), "db": args.db, "pages": pages_n,
+              "generation": main._generation(), "queries": len(corpus), "page_ratio": args.page_ratio,
+              "config": {k: getattr(main, k) for k in ("DB_POOL_SIZE", "DB_WORKERS", "DB_IN_MEMORY", "DB_IMMUTABLE",
+                                                       "PREVIEW_MODE", "SNIPPET_TOKENS", "DB_MMAP_SIZE")},
+              "cache": bool(args.cache), "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+              "cpus": os.cpu_count(), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+def compare(args):
+    a, b = (json.loads(Path(p).read_text(encoding="utf-8")) for p in (args.before, args.after))
+    print(f"{a.get('commit') or args.before} -> {b.get('commit') or args.after}")
+    rb = {r["concurrency"]: r for r in b["results"]}
+    for ra in a["results"]:
+        r = rb.get(ra["concurrency"])
+        if r is None:
+            continue
+        cells = [f"{k}={ra[k]}->{r[k]} ({(r[k] - ra[k]) / ra[k] * 100:+.1f}%)" if ra[k] else f"{k}={ra[k]}->{r[k]}"
+                 for k in ("qps", "p50_ms", "p95_ms", "p99_ms")]
+        print(f"c={ra['concurrency']:<4} " + "  ".join(cells))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="Write a synthetic index")
+    b.add_argument("--db", default="build/bench.db")
+    b.add_argument("--pages", type=int, default=10000, help="Pages across the four buckets (10k-1M)")
+    b.add_argument("--words", type=int, default=400, help="Mean words per page")
+    b.add_argument("--vocab", type=int, default=200000, help="Size of the rare-token tail")
+    b.add_argument("--seed", type=int, default=1)
+    r = sub.add_parser("run", help="Replay queries against main.search/main.page")
+    r.add_argument("--db", default="build/bench.db")
+    r.add_argument("--queries", default="", help="Query corpus, one per line (default: generated)")
+    r.add_argument("--concurrency", default="1,4,16,64", type=lambda s: [int(x) for x in s.split(",")])
+    r.add_argument("--requests", type=int, default=2000, help="Calls per concurrency level")
+    r.add_argument("--warmup", type=int, default=200)
+    r.add_argument("--page-ratio", type=float, default=0.2, help="Share of page() calls")
+    r.add_argument("--cache", action="store_true", help="Keep the search/page caches enabled")
+    r.add_argument("--seed", type=int, default=1)
+    r.add_argument("--out", default="", help="Write JSON here (default: stdout)")
+    c = sub.add_parser("compare", help="Diff two `run` JSON files")
+    c.add_argument("before")
+    c.add_argument("after")
+    args = ap.parse_args()
+    {"build": build, "run": run, "compare": compare}[args.cmd](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,10 @@ Page-level BM25 indexer for Cloudscape:
 - Components: keep only tabId=api|usage (drop playground/testing/example)
 - Patterns: keep all pages under /patterns/**
 - TypeDoc: optionally ingest Markdown from a directory (--typedoc)
-- Stores one row per canonical URL in `pages`, and indexes text into FTS5 `pages_fts`
+- Stores one row per canonical URL in `pages`, and indexes text into external-content FTS5 `pages_fts`
 """
 
-import argparse, json, zipfile, sqlite3, sys, re
+import argparse, json, zipfile, sqlite3, sys, re, time, uuid, hashlib
 from pathlib import Path
 from typing import List, Dict, Iterable, Tuple
 from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
@@ -143,25 +143,180 @@ def clean_text(text: str) -> str:
     return text
 
 # ---------- SQLite ----------
+# External-content FTS5 over `pages`: the index stores no copy of the text, but
+# snippet()/highlight() can still read it back through content_rowid.
+# Columns are indexed separately (title, headings, body) so the server can weight them in bm25().
+# prefix= keeps 2-4 char prefix indexes so `term*` queries skip the full term scan.
+FTS_DDL = ("CREATE VIRTUAL TABLE pages_fts USING fts5(title, headings, text, "
+           "content='pages', content_rowid='id', prefix='2 3 4')")
+FTS_TRIGGERS = {
+    "pages_ai": """CREATE TRIGGER pages_ai AFTER INSERT ON pages BEGIN
+        INSERT INTO pages_fts(rowid, title, headings, text) VALUES (new.id, new.title, new.headings, new.text);
+    END""",
+    "pages_ad": """CREATE TRIGGER pages_ad AFTER DELETE ON pages BEGIN
+        INSERT INTO pages_fts(pages_fts, rowid, title, headings, text)
+        VALUES ('delete', old.id, old.title, old.headings, old.text);
+    END""",
+    "pages_au": """CREATE TRIGGER pages_au AFTER UPDATE OF title, headings, text ON pages BEGIN
+        INSERT INTO pages_fts(pages_fts, rowid, title, headings, text)
+        VALUES ('delete', old.id, old.title, old.headings, old.text);
+        INSERT INTO pages_fts(rowid, title, headings, text) VALUES (new.id, new.title, new.headings, new.text);
+    END""",
+}
+
+def _ensure_fts(db: sqlite3.Connection):
+    """(Re)create pages_fts + sync triggers; rebuilds from `pages` if the FTS layout changed."""
+    have = dict(db.execute("SELECT name, sql FROM sqlite_master WHERE name='pages_fts' OR type='trigger'"))
+    rebuild = have.get("pages_fts") != FTS_DDL
+    for name, ddl in FTS_TRIGGERS.items():
+        if rebuild or have.get(name) != ddl:
+            db.execute(f"DROP TRIGGER IF EXISTS {name}")
+    if rebuild:
+        db.execute("DROP TABLE IF EXISTS pages_fts")
+        db.execute(FTS_DDL)
+    for name, ddl in FTS_TRIGGERS.items():
+        if rebuild or have.get(name) != ddl:
+            db.execute(ddl)
+    if rebuild:
+        db.execute("INSERT INTO pages_fts(pages_fts) VALUES ('rebuild')")
+
+# ---------- hit metadata (precomputed so /search never decodes `text`) ----------
+# section -> search bucket; sections without a bucket are indexed but never returned by /search
+SECTION_BUCKETS = {
+    "components_api":   "components.api",
+    "components_usage": "components.usage",
+    "patterns":         "patterns",
+    "typedoc":          "typedoc",
+}
+LEAD_CHARS = 400
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (~4 chars/token), good enough for budgeting."""
+    return (len(text or "") + 3) // 4
+
+def lead_preview(text: str, width: int = LEAD_CHARS) -> str:
+    s = re.sub(r"\s+", " ", text or "").strip()
+    if len(s) <= width:
+        return s
+    cut = s.rfind(" ", 0, width)
+    return s[:cut if cut > 0 else width] + " …"
+
+def content_hash(text: str) -> str:
+    """Stable per-page content hash, served as the page ETag."""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:20]
+
+def page_meta(text: str, section: str) -> Dict:
+    return {"bucket": SECTION_BUCKETS.get(section), "text_len": len(text or ""), "tokens": estimate_tokens(text),
+            "lead": lead_preview(text), "hash": content_hash(text),
+            "headings": "\n".join(dict.fromkeys(h for h, _, _ in split_sections(text or "") if h))}
+
+META_COLUMNS = {"bucket": "TEXT", "text_len": "INTEGER", "tokens": "INTEGER", "lead": "TEXT", "hash": "TEXT",
+                "headings": "TEXT"}
+
+def _ensure_meta(db: sqlite3.Connection):
+    """Add metadata columns to indexes built by older versions and backfill them."""
+    have = {r[1] for r in db.execute("PRAGMA table_info(pages)")}
+    for col, typ in META_COLUMNS.items():
+        if col not in have:
+            db.execute(f"ALTER TABLE pages ADD COLUMN {col} {typ}")
+    # `bucket` is legitimately NULL for non-search sections; every other column is always set
+    missing = " OR ".join(f"{c} IS NULL" for c in META_COLUMNS if c != "bucket")
+    stale = db.execute(f"SELECT id, text, section FROM pages WHERE {missing}").fetchall()
+    assign = ", ".join(f"{c}=?" for c in META_COLUMNS)
+    for rowid, text, section in stale:
+        m = page_meta(text, section)
+        db.execute(f"UPDATE pages SET {assign} WHERE id=?", (*(m[c] for c in META_COLUMNS), rowid))
+
+# ---------- sections (heading -> character offsets, for ranged /page reads) ----------
+MD_HEADING_RE = re.compile(r"^#{1,6}[ \t]+(.+?)[ \t#]*$", re.M)
+# headings of the crawled site text, which carries no Markdown markup
+SITE_HEADING_RE = re.compile(
+    r"^(Properties|Slots|Events|Functions|Features|Development guidelines|General guidelines|"
+    r"Writing guidelines|Accessibility guidelines|Key UX concepts|Building blocks|Unsupported features|"
+    r"Related components|Related patterns|Component types|Variants|States)[ \t]*$",
+    re.M | re.I,
+)
+
+def split_sections(text: str) -> List[Tuple[str, int, int]]:
+    """Return [(heading, start, end)] character spans covering `text`; the lead-in has heading ''."""
+    rx = MD_HEADING_RE if MD_HEADING_RE.search(text or "") else SITE_HEADING_RE
+    marks = [(m.group(1).strip(), m.start()) for m in rx.finditer(text or "")]
+    spans, prev_h, prev_s = [], "", 0
+    for h, start in marks:
+        if start > prev_s:
+            spans.append((prev_h, prev_s, start))
+        prev_h, prev_s = h, start
+    if len(text or "") > prev_s:
+        spans.append((prev_h, prev_s, len(text)))
+    return spans
+
+def write_sections(db: sqlite3.Connection, page_id: int, text: str):
+    db.execute("DELETE FROM sections WHERE page_id=?", (page_id,))
+    db.executemany(
+        "INSERT INTO sections(page_id, ord, heading, start, stop, tokens) VALUES (?,?,?,?,?,?)",
+        [(page_id, i, h, a, b, estimate_tokens(text[a:b])) for i, (h, a, b) in enumerate(split_sections(text))],
+    )
+
+def _ensure_sections(db: sqlite3.Connection):
+    exists = db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='sections'").fetchone()
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS sections (
+            page_id INTEGER NOT NULL,
+            ord INTEGER NOT NULL,
+            heading TEXT,
+            start INTEGER,
+            stop INTEGER,
+            tokens INTEGER,
+            PRIMARY KEY (page_id, ord)
+        ) WITHOUT ROWID;
+    """)
+    if not exists:   # index built before `sections` existed: backfill
+        for page_id, text in db.execute("SELECT id, text FROM pages").fetchall():
+            write_sections(db, page_id, text or "")
+
 def create_schema(db: sqlite3.Connection):
+    # small metadata columns sit before `text` so reading them never walks the text's overflow pages
     db.execute("""
         CREATE TABLE IF NOT EXISTS pages (
             id INTEGER PRIMARY KEY,
             url TEXT UNIQUE,
             title TEXT,
-            text TEXT,
-            section TEXT
+            section TEXT,
+            bucket TEXT,
+            text_len INTEGER,
+            tokens INTEGER,
+            lead TEXT,
+            hash TEXT,
+            headings TEXT,
+            text TEXT
         );
     """)
-    db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(text, content='');")
+    _ensure_meta(db)
+    db.execute("CREATE INDEX IF NOT EXISTS pages_bucket ON pages(bucket);")
+    _ensure_sections(db)
+    _ensure_fts(db)
+    db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);")
     db.commit()
 
+def write_meta(db: sqlite3.Connection, **kv):
+    db.executemany("INSERT OR REPLACE INTO meta(key, value) VALUES (?,?)", [(k, str(v)) for k, v in kv.items()])
+
+def write_manifest(db: sqlite3.Connection):
+    """Row counts stored in `meta`, so servers report them without COUNT(*) on every readiness poll."""
+    buckets = {b: n for b, n in db.execute("SELECT COALESCE(bucket, 'other'), COUNT(*) FROM pages GROUP BY 1")}
+    sections = db.execute("SELECT COUNT(*) FROM sections").fetchone()[0]
+    write_meta(db, manifest=json.dumps({"pages": sum(buckets.values()), "buckets": buckets, "sections": sections}))
+
 def upsert_page(db: sqlite3.Connection, url: str, title: str, text: str, section: str) -> int:
-    db.execute("INSERT OR REPLACE INTO pages(url, title, text, section) VALUES (?,?,?,?)",
-               (url, title, text, section))
+    m = page_meta(text, section)
+    # ON CONFLICT keeps the rowid stable and fires pages_au, which re-indexes the row
+    cols = ["url", "title", "text", "section", *META_COLUMNS]
+    db.execute(f"""
+        INSERT INTO pages({", ".join(cols)}) VALUES ({",".join("?" * len(cols))})
+        ON CONFLICT(url) DO UPDATE SET {", ".join(f"{c}=excluded.{c}" for c in cols[1:])}
+    """, (url, title, text, section, *(m[c] for c in META_COLUMNS)))
     rowid = db.execute("SELECT id FROM pages WHERE url=?", (url,)).fetchone()[0]
-    db.execute("DELETE FROM pages_fts WHERE rowid=?", (rowid,))
-    db.execute("INSERT INTO pages_fts(rowid, text) VALUES (?,?)", (rowid, text))
+    write_sections(db, rowid, text)
     return rowid
 
 # ---------- main ----------
@@ -229,6 +384,14 @@ def main():
     except sqlite3.DatabaseError:
         pass
 
+    # new generation id => servers drop cached results built from the previous index
+    write_manifest(db)
+    write_meta(db, generation=uuid.uuid4().hex, built_at=int(time.time()))
+    db.commit()
+    # ship a single self-contained file: servers open it read-only (optionally immutable),
+    # which a WAL database cannot guarantee without a writable -shm
+    db.execute("PRAGMA journal_mode=DELETE;")
+
     if args.verbose:
         for k in ["kept","dropped","components_api","components_usage","components_other","patterns","typedoc","other"]:
             print(f"[stats] {k}: {stats.get(k,0)}")
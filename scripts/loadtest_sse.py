@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load test for the MCP SSE transport (GET /sse + POST /messages/), end to end:
+- Opens N concurrent MCP sessions (sse_client + initialize) and records setup time
+- Measures server RSS before/after opening them => memory per session (server started here, or --pid)
+- Drives a search -> page mix from every session for --duration seconds
+- Repeats per session level (e.g. 1,8,32,128) so throughput saturation is visible; emits JSON
+
+  python3 scripts/loadtest_sse.py --db build/index.db --sessions 1,8,32,128 --out sse.json
+  python3 scripts/loadtest_sse.py --url http://localhost:8000 --pid $(pgrep -f main.py)
+"""
+
+import argparse, asyncio, json, os, random, resource, socket, subprocess, sys, time, urllib.request
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+from bench_search import default_queries, summarize
+
+
+def rss_kib(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            return next(int(l.split()[1]) for l in f if l.startswith("VmRSS:"))
+    except (OSError, StopIteration):
+        return 0
+
+
+def start_server(db: str, env_extra: Dict[str, str]) -> tuple[subprocess.Popen, str]:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = {**os.environ, "DB_PATH": db, "INDEX_WATCH_INTERVAL": "0", **env_extra}
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                             "--log-level", "warning"], cwd=str(ROOT), env=env)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(url + "/health", timeout=1).read()
+            return proc, url
+        except OSError:
+            if proc.poll() is not None:
+                raise SystemExit(f"server exited with {proc.returncode}")
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("server did not become healthy")
+
+
+def payload(res) -> Any:
+    return json.loads(res.content[0].text) if res.content and not res.isError else None
+
+
+async def session(url: str, rng: random.Random, queries: List[str], page_ratio: float,
+                  opened: asyncio.Event, go: asyncio.Event, deadline: List[float], st: Dict[str, Any]) -> None:
+    t0 = time.perf_counter()
+    try:
+        async with sse_client(url + "/sse", timeout=30, sse_read_timeout=600) as (r, w):
+            async with ClientSession(r, w) as s:
+                await s.initialize()
+                st["setup"].append(time.perf_counter() - t0)
+                st["open"] += 1
+                if st["open"] == st["want"]:
+                    opened.set()
+                await go.wait()
+                urls: List[str] = []
+                while time.perf_counter() < deadline[0]:
+                    tool = "page" if urls and rng.random() < page_ratio else "search"
+                    args = {"url": rng.choice(urls)} if tool == "page" else {"q": rng.choice(queries)}
+                    t1 = time.perf_counter()
+                    res = await s.call_tool(tool, args)
+                    st[tool].append(time.perf_counter() - t1)
+                    data = payload(res)
+                    if data is None or "error" in data:
+                        st["errors"] += 1
+                    elif tool == "search":   # follow hits like an agent would
+                        urls = [h["url"] for b in (data["components"]["api"], data["components"]["usage"],
+                                                   data["patterns"], data["typedoc"]) for h in b][:5] or urls
+    except Exception as e:   # connection refused / reset: counted, not fatal for the run
+        st["failed"] += 1
+        st["last_error"] = repr(e)
+        if st["open"] + st["failed"] == st["want"]:
+            opened.set()
+
+
+async def level(url: str, pid: int, n: int, args, queries: List[str]) -> Dict[str, Any]:
+    st: Dict[str, Any] = {"want": n, "open": 0, "failed": 0, "errors": 0, "setup": [], "search": [], "page": []}
+    opened, go, deadline = asyncio.Event(), asyncio.Event(), [0.0]
+    rss0 = rss_kib(pid) if pid else 0
+    t0 = time.perf_counter()
+    tasks = [asyncio.create_task(session(url, random.Random(args.seed + i), queries, args.page_ratio,
+                                         opened, go, deadline, st)) for i in range(n)]
+    await opened.wait()
+    setup_wall = time.perf_counter() - t0
+    await asyncio.sleep(0.5)   # let the server settle before sampling memory
+    rss1 = rss_kib(pid) if pid else 0
+    deadline[0] = time.perf_counter() + args.duration
+    go.set()
+    await asyncio.gather(*tasks)
+    calls = len(st["search"]) + len(st["page"])
+    out = {"sessions": n, "opened": st["open"], "failed": st["failed"], "errors": st["errors"],
+           "setup": {**summarize(st["setup"]), "wall_s": round(setup_wall, 3)},
+           "calls": calls, "throughput_rps": round(calls / args.duration, 1),
+           "latency": summarize(st["search"] + st["page"]),
+           "by_tool": {t: summarize(st[t]) for t in ("search", "page") if st[t]}}
+    if pid:
+        out["rss_kib"] = {"before": rss0, "with_sessions": rss1,
+                          "per_session": round((rss1 - rss0) / max(1, st["open"]), 1)}
+    if "last_error" in st:
+        out["last_error"] = st["last_error"]
+    print(f"sessions={n:<5} open={st['open']:<5} setup_p50={out['setup']['p50_ms']}ms "
+          f"rps={out['throughput_rps']:<8} p50={out['latency']['p50_ms']}ms p99={out['latency']['p99_ms']}ms"
+          + (f" rss/session={out['rss_kib']['per_session']}KiB" if pid else ""), file=sys.stderr)
+    return out
+
+
+async def run(args) -> Dict[str, Any]:
+    queries = ([l.strip() for l in open(args.queries, encoding="utf-8") if l.strip() and not l.startswith("#")]
+               if args.queries else default_queries(random.Random(args.seed), 500))
+    proc, url, pid = None, args.url.rstrip("/"), args.pid
+    if not url:
+        proc, url = start_server(args.db, dict(e.split("=", 1) for e in args.env))
+        pid = proc.pid
+    try:
+        results = []
+        for n in args.sessions:
+            results.append(await level(url, pid, n, args, queries))
+            await asyncio.sleep(1)   # let closed sessions drain
+        return {"url": url, "ts": int(time.time()), "duration_s": args.duration, "page_ratio": args.page_ratio,
+                "server_env": args.env, "results": results}
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(10)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="", help="Running server (default: start one on a free port)")
+    ap.add_argument("--pid", type=int, default=0, help="Server pid for RSS sampling with --url")
+    ap.add_argument("--db", default="build/index.db", help="Index for the started server")
+    ap.add_argument("--env", action="append", default=[], help="KEY=VALUE for the started server (repeatable)")
+    ap.add_argument("--sessions", default="1,8,32,128", type=lambda s: [int(x) for x in s.split(",")])
+    ap.add_argument("--duration", type=float, default=10.0, help="Seconds of traffic per level")
+    ap.add_argument("--page-ratio", type=float, default=0.3, help="Share of page() calls after the first search")
+    ap.add_argument("--queries", default="", help="Query corpus, one per line (default: generated)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default="", help="Write JSON here (default: stdout)")
+    args = ap.parse_args()
+
+    # every session holds two sockets on each side
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Aggregate the server's slow-query log (SLOW_QUERY_LOG, or server output containing
+`cloudscape-mcp.slow` lines):
+- Groups entries by kind + MATCH expression (fts) or URL (pages/page_range)
+- Reports count, total/p50/p95/max milliseconds and average rows, slowest first
+- Prints the query plan of the slowest entry in each group
+"""
+
+import argparse, json, sys
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List
+
+
+def read_entries(lines: Iterable[str]) -> Iterable[Dict[str, Any]]:
+    """JSON objects from a JSON-lines file or from log lines with a `prefix:{...}` layout."""
+    for line in lines:
+        i = line.find("{")
+        if i < 0:
+            continue
+        try:
+            e = json.loads(line[i:])
+        except ValueError:
+            continue
+        if isinstance(e, dict) and "kind" in e and "ms" in e:
+            yield e
+
+
+def group_key(e: Dict[str, Any]) -> str:
+    if e["kind"] == "fts":
+        return e.get("match") or e.get("query") or ""
+    return " ".join(e.get("urls") or [])
+
+
+def pct(xs: List[float], p: float) -> float:
+    return xs[min(len(xs) - 1, int(round(p * (len(xs) - 1))))]
+
+
+def aggregate(entries: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    groups: Dict[tuple, List[Dict[str, Any]]] = defaultdict(list)
+    for e in entries:
+        groups[(e["kind"], group_key(e))].append(e)
+    out = []
+    for (kind, key), es in groups.items():
+        ms = sorted(float(e["ms"]) for e in es)
+        worst = max(es, key=lambda e: e["ms"])
+        out.append({"kind": kind, "key": key, "count": len(es), "total_ms": round(sum(ms), 2),
+                    "p50_ms": pct(ms, .5), "p95_ms": pct(ms, .95), "max_ms": ms[-1],
+                    "avg_rows": round(sum(e.get("rows") or 0 for e in es) / len(es), 1),
+                    "k": worst.get("k"), "plan": worst.get("plan") or []})
+    return sorted(out, key=lambda g: g["total_ms"], reverse=True)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("logs", nargs="*", help="Slow-query log files (default: stdin)")
+    ap.add_argument("--top", type=int, default=20, help="Groups to show")
+    ap.add_argument("--kind", choices=["fts", "pages", "page_range"], help="Only this kind of call")
+    ap.add_argument("--json", action="store_true", help="Emit the aggregate as JSON")
+    args = ap.parse_args()
+
+    def lines():
+        if not args.logs:
+            yield from sys.stdin
+        for path in args.logs:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                yield from f
+
+    groups = [g for g in aggregate(read_entries(lines())) if not args.kind or g["kind"] == args.kind][:args.top]
+    if args.json:
+        json.dump(groups, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+    if not groups:
+        print("No slow queries found.")
+        return
+    print(f"{'count':>6} {'total_ms':>10} {'p50':>8} {'p95':>8} {'max':>8} {'rows':>7}  kind        query/url")
+    for g in groups:
+        print(f"{g['count']:>6} {g['total_ms']:>10.1f} {g['p50_ms']:>8.1f} {g['p95_ms']:>8.1f} {g['max_ms']:>8.1f} "
+              f"{g['avg_rows']:>7}  {g['kind']:<10}  {g['key'][:100]}")
+        for i, plan in enumerate(g["plan"]):
+            for step in plan:
+                print(f"{'':>52}{'#' + str(i) + ' ' if len(g['plan']) > 1 else ''}{step}")
+
+
+if __name__ == "__main__":
+    main()